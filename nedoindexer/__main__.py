@@ -14,10 +14,14 @@ from pytoniq import BlockIdExt
 
 from nedoindexer.logger import AsyncFileHandler
 from nedoindexer.blockchain import BlockchainProcessing
+from nedoindexer.cache import FreshnessCache, NegativeCache
 from nedoindexer.db import DatabaseHandler, Jetton, JettonWallet, Wallet
 from nedoindexer.encrypt import convert_raw_to_user_friendly
 from nedoindexer.request import IndexerRequests
+from nedoindexer.profiling import profiler
 from nedoindexer.proxy import ProxyHandler
+from nedoindexer.scheduler import LookupScheduler
+from nedoindexer.snapshot import Snapshot, SnapshotHandler
 
 
 logger = logging.getLogger('nedoindexer')
@@ -42,6 +46,19 @@ load_dotenv()
 
 
 DB_URL = os.getenv('POSTGRESQL_URL')
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'snapshot.json')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 60))
+FRESHNESS_TTL = float(os.getenv('FRESHNESS_TTL', 0))
+NEGATIVE_CACHE_NON_WALLET_TTL = float(os.getenv('NEGATIVE_CACHE_NON_WALLET_TTL', 86400))
+NEGATIVE_CACHE_NO_JETTONS_TTL = float(os.getenv('NEGATIVE_CACHE_NO_JETTONS_TTL', 3600))
+LOOKUP_MAX_BACKLOG = int(os.getenv('LOOKUP_MAX_BACKLOG', 5000))
+LOOKUP_BATCH_SECONDS = float(os.getenv('LOOKUP_BATCH_SECONDS', 10))
+LOOKUP_UNKNOWN_STALENESS = float(os.getenv('LOOKUP_UNKNOWN_STALENESS', 0.5))
+WATCH_LIST_PATH = os.getenv('WATCH_LIST_PATH', 'watch_list.txt')
+HISTORY_MODE = os.getenv('HISTORY_MODE', '0') == '1'
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_WINDOW = float(os.getenv('PROFILE_WINDOW', 60))
+PROFILE_PORT = int(os.getenv('PROFILE_PORT', 0))
 
 
 def nanocoin_conversion(number_str: str) -> float:
@@ -69,7 +86,8 @@ def convert_jettons_wallets_from_response(address: str, response: dict) -> Optio
                     jetton['address'].lower(),
                     *convert_raw_to_user_friendly(jetton['address'].lower()),
                     nanocoin_conversion(jetton['balance']),
-                    last_update
+                    last_update,
+                    int(jetton['balance'])
                 )
             jettons_wallets_list.append(
                 jetton_wallet
@@ -87,7 +105,8 @@ def convert_wallet_from_response(address: str, response: dict) -> Wallet:
         *convert_raw_to_user_friendly(address),
         ''.join(response['wallet_type'].split(' ')[1:]),
         nanocoin_conversion(response['balance']),
-        datetime.datetime.now().replace(microsecond=0)
+        datetime.datetime.now().replace(microsecond=0),
+        int(response['balance'])
     )
     return wallet
 
@@ -99,11 +118,14 @@ async def fetch_and_process(
         proxy: 'ProxyHandler.Proxy',
         url: str,
         converter: Callable[[dict], Optional[Union[list[JettonWallet], Wallet]]],
-        response_key: Literal['jetton_wallets', 'wallet_type']
+        response_key: Literal['jetton_wallets', 'wallet_type'],
+        negative_cache: NegativeCache
     ) -> Optional[Union[list[JettonWallet], Wallet]]:
 
     """
     Общая функция для обработки запросов и проверок.
+
+    Адреса, по которым получен ответ без нужных данных, заносятся в негативный кэш.
     """
     response = await requests_handler.send_request(
         url,
@@ -114,23 +136,26 @@ async def fetch_and_process(
 
     if response and response.get(response_key):
         return converter(address, response)
-    else:
-        return None
+    elif response is not None and (response_key != 'wallet_type' or response.get('status') == 'active'):
+        # неинициализированный адрес может позже стать кошельком, его не кэшируем
+        negative_cache.add(address, NegativeCache.RESPONSE_KINDS[response_key])
+    return None
 
 
 async def process_transactions(
         blockchain_handler: BlockchainProcessing,
         block: BlockIdExt,
-    ) -> list[str]:
+    ) -> tuple[list[str], list[str]]:
     """
     Обработать транзакции блока.
     
-    Помещает полученные адреса в очередь.
+    Возвращает адреса всех транзакций и адреса транзакций с переводами жетонов.
     """
     transactions = await blockchain_handler.get_block_transactions(block)
     addresses = await blockchain_handler.get_transaction_addresses(transactions)
+    jetton_addresses = await blockchain_handler.get_jetton_transfer_addresses(transactions)
 
-    return addresses
+    return addresses, jetton_addresses
 
 
 async def requests_rate_limiter(
@@ -141,7 +166,8 @@ async def requests_rate_limiter(
         wait_for: float,
         url: str,
         converter: Callable[[dict], Optional[Union[list[JettonWallet], Wallet]]],
-        response_key: Literal['jetton_wallets', 'wallet_type']
+        response_key: Literal['jetton_wallets', 'wallet_type'],
+        negative_cache: NegativeCache
     ) -> list[Union[list[JettonWallet], Wallet]]:
     """
     Контролирует отправку запроса с определенной частотой.
@@ -161,7 +187,8 @@ async def requests_rate_limiter(
             proxy,
             url,
             converter,
-            response_key
+            response_key,
+            negative_cache
         )))
         await asyncio.sleep(wait_for)
 
@@ -176,7 +203,8 @@ async def distribution_requests_between_proxies(
         addresses_queue: asyncio.Queue,
         url: str,
         converter: Callable[[dict], Optional[Union[list[JettonWallet], Wallet]]],
-        response_key: Literal['jetton_wallets', 'wallet_type']
+        response_key: Literal['jetton_wallets', 'wallet_type'],
+        negative_cache: NegativeCache
     ) -> list[Union[list[JettonWallet], Wallet]]:
     """
     Для каждого прокси создает отдельную задачу для отправки запросов.
@@ -193,7 +221,8 @@ async def distribution_requests_between_proxies(
                     requests_handler.request_per,
                     url,
                     converter,
-                    response_key
+                    response_key,
+                    negative_cache
                 )
             ))
 
@@ -201,9 +230,11 @@ async def distribution_requests_between_proxies(
         return [obj for sublist in await asyncio.gather(*tasks) for obj in sublist]
     
 
-async def fetch_wallets_info(addresses: list[str], requests_handler: IndexerRequests, proxy_handler: ProxyHandler) -> list[Wallet]:
+async def fetch_wallets_info(addresses: list[str], requests_handler: IndexerRequests, proxy_handler: ProxyHandler, negative_cache: NegativeCache) -> list[Wallet]:
     """
     Собрать информацию о кошельках.
+
+    Адреса запрашиваются в переданном порядке.
     """
     addresses_queue = asyncio.Queue()
     for address in addresses:
@@ -215,19 +246,22 @@ async def fetch_wallets_info(addresses: list[str], requests_handler: IndexerRequ
         addresses_queue,
         requests_handler.get_wallet_info_url,
         convert_wallet_from_response,
-        'wallet_type'
+        'wallet_type',
+        negative_cache
     )
 
 
-async def fetch_jetton_wallets(wallets: list[Wallet], requests_handler: IndexerRequests, proxy_handler: ProxyHandler, available_jettons: set[str]) -> tuple[list[Jetton], list[JettonWallet]]:
+async def fetch_jetton_wallets(wallets: list[Wallet], requests_handler: IndexerRequests, proxy_handler: ProxyHandler, available_jettons: set[str], negative_cache: NegativeCache) -> tuple[list[Jetton], list[JettonWallet]]:
     """
     Собрать информацию о кошельках жетонов.
 
     Также возвращает список жетонов, которых еще нет в БД.
+    Владельцы из негативного кэша (без жетонов) пропускаются.
     """
     addresses_queue = asyncio.Queue()
-    for wallet in wallets:
-        addresses_queue.put_nowait(wallet.raw_address)
+    owners = [wallet.raw_address for wallet in wallets]
+    for address in negative_cache.filter(owners, NegativeCache.NO_JETTONS):
+        addresses_queue.put_nowait(address)
 
     jettons_wallets_list = await distribution_requests_between_proxies(
         requests_handler,
@@ -236,6 +270,7 @@ async def fetch_jetton_wallets(wallets: list[Wallet], requests_handler: IndexerR
         requests_handler.get_jetton_wallets_url,
         convert_jettons_wallets_from_response,
         'jetton_wallets',
+        negative_cache
     )
 
     jetton_wallets: list[JettonWallet] = []
@@ -261,12 +296,12 @@ def check_responses_condition(requests_handler: IndexerRequests, count_addresses
     logger.info(f"[~] Всего получено ответов {response_count}: {requests_handler.condition}")
 
     if requests_handler.condition.get(429, 0) > response_count * 0.01:
-        requests_handler.request_per += 0.1
+        requests_handler.request_per += IndexerRequests.REQUEST_PER_STEP
         logger.info(f"[%] Изменение частоты HTTP запросов: стало {requests_handler.request_per}")
 
     waiting_errors = requests_handler.processed_wallets_count - response_count
     if waiting_errors > requests_handler.processed_wallets_count * 0.005:
-        requests_handler.timeout += 2
+        requests_handler.timeout += IndexerRequests.TIMEOUT_STEP
         logger.info(f"[%] Изменения длительности таймаута: стало {requests_handler.timeout}")
 
     del requests_handler.condition
@@ -278,54 +313,181 @@ def check_responses_condition(requests_handler: IndexerRequests, count_addresses
         return False
 
 
+async def save_snapshot(
+        snapshot_handler: SnapshotHandler,
+        blockchain_handler: BlockchainProcessing,
+        requests_handler: IndexerRequests,
+        proxy_handler: ProxyHandler,
+        available_jettons: set[str],
+        freshness_cache: FreshnessCache
+    ):
+    """
+    Сохранить снимок состояния для быстрого перезапуска.
+    """
+    try:
+        await snapshot_handler.save(
+            blockchain_handler.config,
+            blockchain_handler.config_loaded_at,
+            blockchain_handler.get_alive_liteservers(),
+            requests_handler.timeout,
+            requests_handler.request_per,
+            proxy_handler.get_user_agents(),
+            available_jettons,
+            freshness_cache.dump()
+        )
+    except OSError as ex:
+        logger.error(f"[-] Не удалось сохранить снимок состояния: {ex}")
+
+
+async def load_available_jettons(db_handler: DatabaseHandler, snapshot: Optional[Snapshot]) -> set[str]:
+    """
+    Получить множество известных жетонов.
+
+    Жетоны из снимка состояния используются, только если они совпадают с таблицей
+    Jetton по количеству и наибольшему адресу, иначе жетоны загружаются из БД.
+    """
+    if snapshot and snapshot.jettons is not None:
+        count, max_address = await db_handler.get_jettons_summary()
+        if len(snapshot.jettons) == count and max(snapshot.jettons, default=None) == max_address:
+            return snapshot.jettons
+        logger.warning("[!] Жетоны в снимке состояния не совпадают с БД, загрузка из БД.")
+
+    return {*await db_handler.get_jettons_addresses()}
+
+
+async def start_blockchain_handler(snapshot: Optional[Snapshot]) -> BlockchainProcessing:
+    """
+    Запустить клиент для работы с блокчейном.
+
+    Если в снимке состояния есть конфигурация сети, сначала подключается к работающим
+    лайт-серверам из нее, при неудаче - ко всем серверам заново загруженной конфигурации.
+    """
+    if snapshot and snapshot.blockchain_config:
+        blockchain_handler = BlockchainProcessing(
+            config=snapshot.blockchain_config,
+            config_loaded_at=snapshot.config_saved_at,
+            liteservers=snapshot.liteservers
+        )
+        try:
+            await blockchain_handler.start_up()
+        except Exception as ex:
+            logger.error(f"[-] Не удалось подключиться к лайт-серверам из снимка состояния: {ex}")
+            await blockchain_handler.shutdown()
+        else:
+            return blockchain_handler
+
+    blockchain_handler = BlockchainProcessing()
+    await blockchain_handler.start_up()
+    return blockchain_handler
+
+
 async def process_blockchain(
         blockchain_handler: BlockchainProcessing,
         requests_handler: IndexerRequests,
         db_handler: DatabaseHandler,
         proxy_handler: ProxyHandler,
-        available_jettons: set[str]
+        available_jettons: set[str],
+        freshness_cache: FreshnessCache,
+        negative_cache: NegativeCache,
+        scheduler: LookupScheduler,
+        snapshot_handler: SnapshotHandler
     ):
     """
     Обработать последние сгенерированные блоки.
     """
+    last_snapshot_time = time()
     async for latest_blocks in blockchain_handler.get_last_blocks():
         start_time = time()
-        transaction_tasks = [process_transactions(blockchain_handler, block) for block in latest_blocks]
-        addresses = list(chain(*await asyncio.gather(*transaction_tasks)))
-
-        if not addresses:
+        with profiler.stage('process_blockchain.transactions'):
+            transaction_tasks = [process_transactions(blockchain_handler, block) for block in latest_blocks]
+            blocks_addresses = await asyncio.gather(*transaction_tasks)
+            addresses = list(chain(*(block_addresses for block_addresses, _ in blocks_addresses)))
+            jetton_addresses = list(chain(*(block_jetton_addresses for _, block_jetton_addresses in blocks_addresses)))
+
+        # отложенные адреса обрабатываются и без новых транзакций
+        if not addresses and not scheduler:
             continue
 
-        logger.info(f"[+] {len(addresses)} адресов получено.")
+        negative_cache.evict(jetton_addresses, NegativeCache.NO_JETTONS)
 
-        wallets = await fetch_wallets_info(addresses, requests_handler, proxy_handler)
-        await db_handler.save_wallets(wallets)
+        logger.info(f"[+] {len(addresses)} адресов получено, отложено {len(scheduler)}.")
 
-        new_jettons, jetton_wallets = await fetch_jetton_wallets(wallets, requests_handler, proxy_handler, available_jettons)
-        await db_handler.save_jettons(new_jettons)
-        await db_handler.save_jettons_wallets(jetton_wallets)
+        with profiler.stage('process_blockchain.schedule'):
+            stale_addresses = negative_cache.filter(freshness_cache.get_stale(addresses), NegativeCache.NON_WALLET)
+            scheduler.observe(addresses)
+            scheduler.push(stale_addresses, await db_handler.get_accounts_last_update(stale_addresses))
+            scheduled_addresses = scheduler.take(
+                scheduler.get_capacity(len(proxy_handler.get_proxies()), requests_handler.request_per)
+            )
 
-        logger.info(f"[~] Всего обработано {len(addresses)} адресов и их жетонов за {time() - start_time} сек.")
+        with profiler.stage('process_blockchain.fetch_wallets_info'):
+            wallets = await fetch_wallets_info(scheduled_addresses, requests_handler, proxy_handler, negative_cache)
+        freshness_cache.touch([wallet.raw_address for wallet in wallets])
+        wallets.sort(key=lambda wallet: scheduler.get_priority(wallet.raw_address))
+        with profiler.stage('process_blockchain.save_wallets'):
+            await db_handler.save_wallets(wallets)
+
+        with profiler.stage('process_blockchain.fetch_jetton_wallets'):
+            new_jettons, jetton_wallets = await fetch_jetton_wallets(wallets, requests_handler, proxy_handler, available_jettons, negative_cache)
+        with profiler.stage('process_blockchain.save_jettons'):
+            await db_handler.save_jettons(new_jettons)
+            await db_handler.save_jettons_wallets(jetton_wallets)
+        with profiler.stage('process_blockchain.save_negative_cache'):
+            await db_handler.save_negative_cache(negative_cache.pop_pending())
+            negative_cache.prune()
+
+        profiler.record('process_blockchain.batch', time() - start_time)
+
+        logger.info(
+            f"[~] Всего обработано {len(scheduled_addresses)} адресов и их жетонов за {time() - start_time} сек. "
+            f"(получено {len(addresses)}, отложено {len(scheduler)}, отброшено {scheduler.last_shed_count})."
+        )
 
         if check_responses_condition(requests_handler, len(addresses)):
             logger.warning(f"[!] Критическое состояние обращений к серверу, перезапуск обработки.")
             break
 
+        if time() - last_snapshot_time >= SNAPSHOT_INTERVAL:
+            await save_snapshot(
+                snapshot_handler,
+                blockchain_handler,
+                requests_handler,
+                proxy_handler,
+                available_jettons,
+                freshness_cache
+            )
+            last_snapshot_time = time()
+
 
 async def main():
-    blockchain_handler = BlockchainProcessing()
+    profiler.output_dir = PROFILE_DIR
+    profiler.window = PROFILE_WINDOW
+    await profiler.install(PROFILE_PORT)
 
-    await blockchain_handler.start_up()
+    snapshot_handler = SnapshotHandler(SNAPSHOT_PATH)
+    snapshot = snapshot_handler.load()
 
-    db_handler = DatabaseHandler(DB_URL)
+    blockchain_handler = await start_blockchain_handler(snapshot)
+
+    db_handler = DatabaseHandler(DB_URL, HISTORY_MODE)
     await db_handler.connect()
 
     proxy_handler = ProxyHandler()
-    proxy_handler.set_proxies()
-
-    requests_handler = IndexerRequests()
+    freshness_cache = FreshnessCache(FRESHNESS_TTL)
+    negative_cache = NegativeCache(NEGATIVE_CACHE_NON_WALLET_TTL, NEGATIVE_CACHE_NO_JETTONS_TTL)
+    negative_cache.load(await db_handler.get_negative_cache())
+    scheduler = LookupScheduler(LOOKUP_MAX_BACKLOG, LOOKUP_BATCH_SECONDS, unknown_staleness=LOOKUP_UNKNOWN_STALENESS)
+    scheduler.set_watch_list(WATCH_LIST_PATH)
+
+    if snapshot:
+        proxy_handler.set_proxies(user_agents=snapshot.user_agents)
+        requests_handler = IndexerRequests.restore(snapshot.timeout, snapshot.request_per)
+        freshness_cache.load(snapshot.freshness)
+    else:
+        proxy_handler.set_proxies()
+        requests_handler = IndexerRequests()
 
-    available_jettons = {*await db_handler.get_jettons_addresses()}
+    available_jettons = await load_available_jettons(db_handler, snapshot)
     
     blockchain_processing_task = asyncio.create_task(
         process_blockchain(
@@ -334,11 +496,26 @@ async def main():
             db_handler,
             proxy_handler,
             available_jettons,
+            freshness_cache,
+            negative_cache,
+            scheduler,
+            snapshot_handler,
         )
     )
 
     await asyncio.gather(blockchain_processing_task)
 
+    await save_snapshot(
+        snapshot_handler,
+        blockchain_handler,
+        requests_handler,
+        proxy_handler,
+        available_jettons,
+        freshness_cache
+    )
+
+    await profiler.uninstall()
+
     await blockchain_handler.shutdown()
 
     await db_handler.close()
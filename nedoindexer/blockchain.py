@@ -1,6 +1,8 @@
 import logging
-from typing import AsyncIterator
+from time import time
+from typing import AsyncIterator, Optional
 
+import requests
 from pytoniq import LiteBalancer, Transaction, BlockIdExt
 from pytoniq.liteclient.client import LiteServerError
 
@@ -8,11 +10,38 @@ from pytoniq.liteclient.client import LiteServerError
 logger = logging.getLogger('nedoindexer.blockchain')
 
 
+MAINNET_CONFIG_URL = 'https://ton.org/global-config.json'
+
+# transfer, internal_transfer, transfer_notification, excesses (TEP-74)
+JETTON_OPCODES = {0x0f8a7ea5, 0x178d4519, 0x7362d09c, 0xd53276db}
+
+
 class BlockchainProcessing:
     """Класс для взаимодействия с блокчейном."""
 
-    def __init__(self, trust_level: int=2) -> None:
-        self.client = LiteBalancer.from_mainnet_config(trust_level)
+    def __init__(
+            self,
+            trust_level: int=2,
+            config: Optional[dict]=None,
+            config_loaded_at: Optional[float]=None,
+            liteservers: Optional[list[int]]=None
+        ) -> None:
+        """
+        config - полная конфигурация сети, по умолчанию загружается с ton.org.
+        config_loaded_at - время загрузки config из сети.
+        liteservers - индексы лайт-серверов config, к которым подключается клиент,
+        по умолчанию все.
+        """
+        if config is None:
+            config = requests.get(MAINNET_CONFIG_URL).json()
+            config_loaded_at = time()
+        self.config = config
+        self.config_loaded_at = config_loaded_at or time()
+        self.liteservers = liteservers or list(range(len(config['liteservers'])))
+
+        client_config = config.copy()
+        client_config['liteservers'] = [config['liteservers'][i] for i in self.liteservers]
+        self.client = LiteBalancer.from_config(client_config, trust_level)
 
     async def start_up(self):
         """Запустить клиент для работы с блокчейном."""
@@ -28,6 +57,17 @@ class BlockchainProcessing:
         await self.client.close_all()
         logger.info("[^] Клиент закрыт")
 
+    def get_alive_liteservers(self) -> list[int]:
+        """
+        Получить индексы работающих лайт-серверов в полной конфигурации.
+
+        Используется для быстрого запуска клиента из снимка состояния. Если клиент
+        не сообщает о работающих серверах, возвращаются все подключенные серверы.
+        """
+        alive_peers = getattr(self.client, '_alive_peers', None)
+        if not alive_peers:
+            return self.liteservers
+        return sorted(self.liteservers[i] for i in alive_peers)
 
     async def get_last_blocks(self) -> AsyncIterator[list[BlockIdExt]]:
         """
@@ -82,4 +122,29 @@ class BlockchainProcessing:
 
             addresses.extend([src, dest])
         
+        return addresses
+
+    async def get_jetton_transfer_addresses(self, transactions: list[Transaction]) -> list[str]:
+        """
+        Получить адреса (отправитель и получатель) транзакций, связанных с переводами жетонов.
+
+        Обрабатывает только внутреннние транзакции, тело входящего сообщения которых
+        начинается с операции стандарта жетонов.
+        """
+        addresses = []
+
+        for tr in transactions:
+            if not tr.in_msg.is_internal:
+                continue
+
+            body = tr.in_msg.body.begin_parse()
+            if body.remaining_bits < 32 or body.load_uint(32) not in JETTON_OPCODES:
+                continue
+
+            message = tr.in_msg.info
+            src = ':'.join(str(value) for value in message.src.to_tl_account_id().values())
+            dest = ':'.join(str(value) for value in message.dest.to_tl_account_id().values())
+
+            addresses.extend([src, dest])
+
         return addresses
\ No newline at end of file
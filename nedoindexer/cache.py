@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime
+from time import time
+
+from nedoindexer.db import NegativeCacheEntry
+from nedoindexer.encrypt import pack_raw_address
+
+
+logger = logging.getLogger('nedoindexer.cache')
+
+
+class FreshnessCache:
+    """
+    Кэш свежести адресов.
+
+    Отбрасывает повторы адресов в одной обработке. Если задан ttl больше нуля,
+    дополнительно не запрашивает адреса, обновленные менее ttl секунд назад, даже
+    если они встретились в новых транзакциях, - такие обновления теряются до
+    следующей активности адреса после ttl. По умолчанию ttl равен нулю, и время
+    обновления адресов не хранится.
+    """
+
+    def __init__(self, ttl: float=0) -> None:
+        self.ttl = ttl
+        self._updated: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._updated)
+
+    def touch(self, addresses: list[str]) -> None:
+        """Отметить адреса как только что обновленные."""
+        if not self.ttl:
+            return
+        now = time()
+        for address in addresses:
+            self._updated[address] = now
+
+    def get_stale(self, addresses: list[str]) -> list[str]:
+        """
+        Получить адреса, требующие обновления.
+
+        Повторы адресов отбрасываются, порядок сохраняется.
+        """
+        if not self.ttl:
+            return list(dict.fromkeys(addresses))
+        expired = time() - self.ttl
+        return [
+            address for address in dict.fromkeys(addresses)
+            if self._updated.get(address, 0) < expired
+        ]
+
+    def prune(self) -> None:
+        """Удалить устаревшие записи."""
+        expired = time() - self.ttl
+        self._updated = {address: updated for address, updated in self._updated.items() if updated >= expired}
+
+    def dump(self) -> dict[str, float]:
+        """Получить содержимое кэша для снимка состояния."""
+        if not self.ttl:
+            return {}
+        self.prune()
+        return dict(self._updated)
+
+    def load(self, updated: dict[str, float]) -> None:
+        """Восстановить содержимое кэша из снимка состояния."""
+        if not self.ttl:
+            return
+        self._updated.update(updated)
+        self.prune()
+        logger.info(f"[+] В кэш свежести загружено {len(self._updated)} адресов.")
+
+
+class NegativeCache:
+    """
+    Негативный кэш адресов.
+
+    Хранит развернутые контракты, которые не являются кошельками (пулы DEX, кошельки
+    жетонов и т.д.), и владельцев без жетонов, чтобы не тратить на них запросы
+    к индексатору до истечения срока хранения. Владельцы удаляются из кэша досрочно
+    при переводе жетонов. Адреса хранятся в упакованном виде (33 байта), новые записи
+    накапливаются для сохранения в БД.
+    """
+
+    NON_WALLET = 0
+    NO_JETTONS = 1
+
+    RESPONSE_KINDS = {
+        'wallet_type': NON_WALLET,
+        'jetton_wallets': NO_JETTONS,
+    }
+
+    def __init__(self, non_wallet_ttl: float=86400, no_jettons_ttl: float=3600) -> None:
+        self.ttls = {
+            self.NON_WALLET: non_wallet_ttl,
+            self.NO_JETTONS: no_jettons_ttl,
+        }
+        self._expires: dict[int, dict[bytes, float]] = {kind: {} for kind in self.ttls}
+        self._pending: list[NegativeCacheEntry] = []
+
+    def __len__(self) -> int:
+        return sum(len(expires) for expires in self._expires.values())
+
+    def add(self, address: str, kind: int) -> None:
+        """Добавить адрес в кэш."""
+        packed = pack_raw_address(address)
+        expires_at = time() + self.ttls[kind]
+        self._expires[kind][packed] = expires_at
+        self._pending.append(NegativeCacheEntry(packed, kind, datetime.fromtimestamp(expires_at).replace(microsecond=0)))
+
+    def evict(self, addresses: list[str], kind: int) -> None:
+        """Досрочно удалить адреса из кэша, в том числе из БД."""
+        expires = self._expires[kind]
+        expired_at = datetime.now().replace(microsecond=0)
+        for address in addresses:
+            packed = pack_raw_address(address)
+            if expires.pop(packed, None) is not None:
+                self._pending.append(NegativeCacheEntry(packed, kind, expired_at))
+
+    def prune(self) -> None:
+        """Удалить истекшие записи из памяти."""
+        now = time()
+        for kind, expires in self._expires.items():
+            self._expires[kind] = {packed: expires_at for packed, expires_at in expires.items() if expires_at > now}
+
+    def filter(self, addresses: list[str], kind: int) -> list[str]:
+        """Отбросить адреса, находящиеся в кэше."""
+        now = time()
+        expires = self._expires[kind]
+        return [address for address in addresses if expires.get(pack_raw_address(address), 0) <= now]
+
+    def pop_pending(self) -> list[NegativeCacheEntry]:
+        """Получить записи, еще не сохраненные в БД."""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def load(self, entries: list[NegativeCacheEntry]) -> None:
+        """Загрузить записи из БД."""
+        for entry in entries:
+            self._expires[entry.kind][entry.address] = entry.expires_at.timestamp()
+        logger.info(f"[+] В негативный кэш загружено {len(entries)} адресов.")
@@ -1,9 +1,13 @@
 import logging
-from typing import NamedTuple
+from decimal import Decimal
+from typing import NamedTuple, Optional
 from datetime import datetime
 
 import asyncpg
 
+from nedoindexer.encrypt import pack_raw_address, unpack_raw_address
+from nedoindexer.profiling import trace
+
 
 logger = logging.getLogger('nedoindexer.db')
 
@@ -16,6 +20,7 @@ class Wallet(NamedTuple):
     wallet_type: str
     balance: int
     last_update: datetime
+    nano_balance: int
 
 
 class Jetton(NamedTuple):
@@ -34,6 +39,14 @@ class JettonWallet(NamedTuple):
     nonbounceable_jetton_wallet: str
     balance: int
     last_update: datetime
+    nano_balance: int
+
+
+class NegativeCacheEntry(NamedTuple):
+    """Представление записи негативного кэша."""
+    address: bytes
+    kind: int
+    expires_at: datetime
 
 
 class DatabaseHandler:
@@ -64,50 +77,292 @@ class DatabaseHandler:
         last_update TIMESTAMP,
         PRIMARY KEY (owner_wallet, jetton_master)
     )
+
+    NegativeCache (
+        address BYTEA,
+        kind SMALLINT,
+        expires_at TIMESTAMP,
+        PRIMARY KEY (address, kind)
+    )
+
+    В режиме истории (history=True) изменившиеся балансы дописываются через COPY
+    в секционированные по месяцам таблицы, которые только пополняются:
+
+    AccountHistory (
+        address BYTEA,
+        balance BIGINT,
+        recorded_at TIMESTAMP
+    ) PARTITION BY RANGE (recorded_at)
+
+    AccountJettonsHistory (
+        owner_address BYTEA,
+        jetton_master BYTEA,
+        balance NUMERIC,
+        recorded_at TIMESTAMP
+    ) PARTITION BY RANGE (recorded_at)
+
+    Адреса хранятся упакованными (33 байта), балансы - целыми в наномонетах.
     """
 
-    def __init__(self, db_url: str) -> None:
+    HISTORY_TABLES = ('AccountHistory', 'AccountJettonsHistory')
+
+    def __init__(self, db_url: str, history: bool=False) -> None:
         self.db_url = db_url
         self.pool = None
+        self.history = history
+        self._history_partitions: set[tuple[int, int]] = set()
         self.insert_account_expression = "INSERT INTO Account VALUES ($1, $2, $3, $4, $5, $6) \
             ON CONFLICT (raw_address) DO UPDATE SET balance = EXCLUDED.balance, last_update = EXCLUDED.last_update"
         self.insert_jetton_expression = "INSERT INTO Jetton VALUES ($1, $2, $3) ON CONFLICT DO NOTHING"
         self.insert_accountjetton_expression = "INSERT INTO AccountJettons VALUES ($1, $2, $3, $4, $5, $6, $7) \
             ON CONFLICT (owner_wallet, jetton_master) DO UPDATE SET balance = EXCLUDED.balance, last_update = EXCLUDED.last_update"
         self.select_jettons_expresssion = "SELECT raw_address FROM Jetton"
+        self.select_jettons_summary_expression = "SELECT count(*), max(raw_address COLLATE \"C\") FROM Jetton"
+        self.select_accounts_last_update_expression = "SELECT raw_address, last_update FROM Account \
+            WHERE raw_address = ANY($1::VARCHAR[])"
+        self.create_negativecache_expression = "CREATE TABLE IF NOT EXISTS NegativeCache ( \
+            address BYTEA, kind SMALLINT, expires_at TIMESTAMP, PRIMARY KEY (address, kind))"
+        self.insert_negativecache_expression = "INSERT INTO NegativeCache VALUES ($1, $2, $3) \
+            ON CONFLICT (address, kind) DO UPDATE SET expires_at = EXCLUDED.expires_at"
+        self.delete_negativecache_expression = "DELETE FROM NegativeCache WHERE expires_at <= $1"
+        self.select_negativecache_expression = "SELECT address, kind, expires_at FROM NegativeCache WHERE expires_at > $1"
+        self.create_accounthistory_expression = "CREATE TABLE IF NOT EXISTS AccountHistory ( \
+            address BYTEA NOT NULL, balance BIGINT NOT NULL, recorded_at TIMESTAMP NOT NULL \
+            ) PARTITION BY RANGE (recorded_at); \
+            CREATE INDEX IF NOT EXISTS accounthistory_address_idx ON AccountHistory (address, recorded_at)"
+        self.create_accountjettonshistory_expression = "CREATE TABLE IF NOT EXISTS AccountJettonsHistory ( \
+            owner_address BYTEA NOT NULL, jetton_master BYTEA NOT NULL, balance NUMERIC NOT NULL, recorded_at TIMESTAMP NOT NULL \
+            ) PARTITION BY RANGE (recorded_at); \
+            CREATE INDEX IF NOT EXISTS accountjettonshistory_owner_idx \
+            ON AccountJettonsHistory (owner_address, jetton_master, recorded_at)"
+        self.create_history_partition_expression = "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} \
+            FOR VALUES FROM ('{start}') TO ('{end}')"
+        self.select_history_partitions_expression = "SELECT child.relname AS partition FROM pg_inherits \
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid \
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid \
+            WHERE parent.relname = $1"
+        self.detach_history_partition_expression = "ALTER TABLE {table} DETACH PARTITION {partition}"
+        self.select_last_accounthistory_expression = "SELECT history.address, history.balance \
+            FROM unnest($1::BYTEA[]) AS keys(address) CROSS JOIN LATERAL ( \
+            SELECT address, balance FROM AccountHistory WHERE address = keys.address \
+            ORDER BY recorded_at DESC LIMIT 1) history"
+        self.select_last_accountjettonshistory_expression = "SELECT history.owner_address, history.jetton_master, history.balance \
+            FROM unnest($1::BYTEA[], $2::BYTEA[]) AS keys(owner_address, jetton_master) CROSS JOIN LATERAL ( \
+            SELECT owner_address, jetton_master, balance FROM AccountJettonsHistory \
+            WHERE owner_address = keys.owner_address AND jetton_master = keys.jetton_master \
+            ORDER BY recorded_at DESC LIMIT 1) history"
+        self.select_balance_at_expression = "SELECT balance FROM AccountHistory \
+            WHERE address = $1 AND recorded_at <= $2 ORDER BY recorded_at DESC LIMIT 1"
+        self.select_jetton_balances_at_expression = "SELECT DISTINCT ON (jetton_master) jetton_master, balance \
+            FROM AccountJettonsHistory WHERE owner_address = $1 AND recorded_at <= $2 \
+            ORDER BY jetton_master, recorded_at DESC"
 
     async def connect(self):
         """Инициализировать пул соединений."""
         self.pool = await asyncpg.create_pool(self.db_url)
+        async with self.pool.acquire() as connection:
+            await connection.execute(self.create_negativecache_expression)
+            if self.history:
+                await connection.execute(self.create_accounthistory_expression)
+                await connection.execute(self.create_accountjettonshistory_expression)
 
     async def close(self):
         """Закрыть пул соединений."""
         await self.pool.close()
 
+    @trace('DatabaseHandler.save_wallets')
     async def save_wallets(self, wallets: list[Wallet]):
         """Сохранить адреса в БД."""
+        records = [
+            (
+                wallet.raw_address,
+                wallet.bounceable_jetton_wallet,
+                wallet.nonbounceable_jetton_wallet,
+                wallet.wallet_type,
+                wallet.balance,
+                wallet.last_update
+            )
+            for wallet in wallets
+        ]
         async with self.pool.acquire() as connection:
-            await connection.executemany(self.insert_account_expression, [tuple(wallet) for wallet in wallets])
+            async with connection.transaction():
+                if self.history:
+                    await self._append_accounts_history(connection, wallets)
+                await connection.executemany(self.insert_account_expression, records)
         logger.info(f"[+] {len(wallets)} кошельков вставлены в БД.")
 
+    @trace('DatabaseHandler.save_jettons')
     async def save_jettons(self, jettons: list[Jetton]):
         """Сохранить жетон в БД."""
         async with self.pool.acquire() as connection:
             await connection.executemany(self.insert_jetton_expression, [tuple(jetton) for jetton in jettons])
         logger.info(f"[+] {len(jettons)} жетонов записан в БД.")
 
+    @trace('DatabaseHandler.save_jettons_wallets')
     async def save_jettons_wallets(self, jettons_wallets: list[JettonWallet]):
         """Сохранить жетоны кошелька."""        
-        async with self.pool.acquire() as connection:
-            await connection.executemany(
-                self.insert_accountjetton_expression,
-                [tuple(jetton_wallet) for jetton_wallet in jettons_wallets]
+        records = [
+            (
+                jetton_wallet.owner_address,
+                jetton_wallet.jetton_master,
+                jetton_wallet.raw_jetton_wallet,
+                jetton_wallet.bounceable_jetton_wallet,
+                jetton_wallet.nonbounceable_jetton_wallet,
+                jetton_wallet.balance,
+                jetton_wallet.last_update
             )
+            for jetton_wallet in jettons_wallets
+        ]
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                if self.history:
+                    await self._append_accountjettons_history(connection, jettons_wallets)
+                await connection.executemany(self.insert_accountjetton_expression, records)
         logger.info(f"[+] {len(jettons_wallets)} кошельков жетонов записаны в БД.")
 
+    @trace('DatabaseHandler.get_jettons_addresses')
     async def get_jettons_addresses(self) -> list[str]:
         """Получить список raw-адресов жетонов."""
         async with self.pool.acquire() as connection:
             records = await connection.fetch(self.select_jettons_expresssion)
         logger.info(f"[+] Из БД получены {len(records)} жетонов.")
-        return [record['raw_address'] for record in records]
\ No newline at end of file
+        return [record['raw_address'] for record in records]
+
+    async def get_jettons_summary(self) -> tuple[int, Optional[str]]:
+        """Получить количество жетонов и наибольший raw-адрес жетона."""
+        async with self.pool.acquire() as connection:
+            count, max_address = await connection.fetchrow(self.select_jettons_summary_expression)
+        return count, max_address
+
+    @trace('DatabaseHandler.get_accounts_last_update')
+    async def get_accounts_last_update(self, addresses: list[str]) -> dict[str, datetime]:
+        """Получить время последнего обновления кошельков, которые уже есть в БД."""
+        async with self.pool.acquire() as connection:
+            records = await connection.fetch(self.select_accounts_last_update_expression, addresses)
+        return {record['raw_address']: record['last_update'] for record in records}
+
+    @trace('DatabaseHandler.save_negative_cache')
+    async def save_negative_cache(self, entries: list[NegativeCacheEntry]):
+        """Сохранить записи негативного кэша."""
+        if not entries:
+            return
+        async with self.pool.acquire() as connection:
+            await connection.executemany(self.insert_negativecache_expression, [tuple(entry) for entry in entries])
+        logger.info(f"[+] {len(entries)} записей негативного кэша записаны в БД.")
+
+    @trace('DatabaseHandler.get_negative_cache')
+    async def get_negative_cache(self) -> list[NegativeCacheEntry]:
+        """Получить действующие записи негативного кэша, удалив истекшие."""
+        now = datetime.now().replace(microsecond=0)
+        async with self.pool.acquire() as connection:
+            await connection.execute(self.delete_negativecache_expression, now)
+            records = await connection.fetch(self.select_negativecache_expression, now)
+        logger.info(f"[+] Из БД получены {len(records)} записей негативного кэша.")
+        return [NegativeCacheEntry(record['address'], record['kind'], record['expires_at']) for record in records]
+
+    async def _ensure_history_partitions(self, connection: asyncpg.Connection, recorded_at: datetime):
+        """Создать месячные секции таблиц истории для recorded_at и следующего месяца."""
+        month_index = recorded_at.year * 12 + recorded_at.month - 1
+        for index in (month_index, month_index + 1):
+            year, month = divmod(index, 12)
+            month += 1
+            if (year, month) in self._history_partitions:
+                continue
+            start = datetime(year, month, 1)
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+            for table in self.HISTORY_TABLES:
+                await connection.execute(self.create_history_partition_expression.format(
+                    partition=f"{table}_{year}_{month:02d}",
+                    table=table,
+                    start=start.isoformat(),
+                    end=end.isoformat()
+                ))
+            self._history_partitions.add((year, month))
+
+    async def _append_accounts_history(self, connection: asyncpg.Connection, wallets: list[Wallet]):
+        """Дописать в историю балансы кошельков, изменившиеся относительно последней записи истории."""
+        addresses = [pack_raw_address(wallet.raw_address) for wallet in wallets]
+        records = await connection.fetch(self.select_last_accounthistory_expression, addresses)
+        previous = {record['address']: record['balance'] for record in records}
+        changed = [
+            (address, wallet) for address, wallet in zip(addresses, wallets)
+            if previous.get(address) != wallet.nano_balance
+        ]
+        if not changed:
+            return
+
+        await self._ensure_history_partitions(connection, max(wallet.last_update for _, wallet in changed))
+        await connection.copy_records_to_table(
+            'accounthistory',
+            records=[(address, wallet.nano_balance, wallet.last_update) for address, wallet in changed],
+            columns=('address', 'balance', 'recorded_at')
+        )
+        logger.info(f"[+] {len(changed)} изменений балансов кошельков записаны в историю.")
+
+    async def _append_accountjettons_history(self, connection: asyncpg.Connection, jettons_wallets: list[JettonWallet]):
+        """Дописать в историю балансы кошельков жетонов, изменившиеся относительно последней записи истории."""
+        keys = [
+            (pack_raw_address(jetton_wallet.owner_address), pack_raw_address(jetton_wallet.jetton_master))
+            for jetton_wallet in jettons_wallets
+        ]
+        records = await connection.fetch(
+            self.select_last_accountjettonshistory_expression,
+            [owner for owner, _ in keys],
+            [jetton_master for _, jetton_master in keys]
+        )
+        previous = {(record['owner_address'], record['jetton_master']): int(record['balance']) for record in records}
+        changed = [
+            (key, jetton_wallet) for key, jetton_wallet in zip(keys, jettons_wallets)
+            if previous.get(key) != jetton_wallet.nano_balance
+        ]
+        if not changed:
+            return
+
+        await self._ensure_history_partitions(connection, max(jetton_wallet.last_update for _, jetton_wallet in changed))
+        await connection.copy_records_to_table(
+            'accountjettonshistory',
+            records=[
+                (owner, jetton_master, Decimal(jetton_wallet.nano_balance), jetton_wallet.last_update)
+                for (owner, jetton_master), jetton_wallet in changed
+            ],
+            columns=('owner_address', 'jetton_master', 'balance', 'recorded_at')
+        )
+        logger.info(f"[+] {len(changed)} изменений балансов жетонов записаны в историю.")
+
+    async def detach_history_partitions(self, before: datetime) -> list[str]:
+        """
+        Отсоединить секции истории, целиком лежащие раньше before.
+
+        Отсоединенные таблицы остаются в БД и могут быть выгружены, сжаты или удалены.
+        """
+        detached = []
+        async with self.pool.acquire() as connection:
+            for table in self.HISTORY_TABLES:
+                records = await connection.fetch(self.select_history_partitions_expression, table.lower())
+                for record in records:
+                    year, month = map(int, record['partition'].rsplit('_', 2)[1:])
+                    end = datetime(year + month // 12, month % 12 + 1, 1)
+                    if end > before:
+                        continue
+                    await connection.execute(self.detach_history_partition_expression.format(
+                        table=table,
+                        partition=record['partition']
+                    ))
+                    self._history_partitions.discard((year, month))
+                    detached.append(record['partition'])
+        logger.info(f"[-] Отсоединены секции истории: {', '.join(detached) or 'нет'}.")
+        return detached
+
+    @trace('DatabaseHandler.get_balance_at')
+    async def get_balance_at(self, raw_address: str, at: datetime) -> Optional[int]:
+        """Получить баланс кошелька в наномонетах на момент at."""
+        async with self.pool.acquire() as connection:
+            balance = await connection.fetchval(self.select_balance_at_expression, pack_raw_address(raw_address), at)
+        return balance
+
+    @trace('DatabaseHandler.get_jetton_balances_at')
+    async def get_jetton_balances_at(self, owner_address: str, at: datetime) -> dict[str, int]:
+        """Получить балансы жетонов владельца на момент at: {raw-адрес жетона: баланс}."""
+        async with self.pool.acquire() as connection:
+            records = await connection.fetch(self.select_jetton_balances_at_expression, pack_raw_address(owner_address), at)
+        return {unpack_raw_address(record['jetton_master']): int(record['balance']) for record in records}
\ No newline at end of file
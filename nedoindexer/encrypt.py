@@ -18,6 +18,18 @@ def ton_crc16(data: bytes) -> bytes:
     return struct.pack('>H', reg)
 
 
+def pack_raw_address(raw_address: str) -> bytes:
+    """Pack raw address into 33 bytes: signed workchain byte and 32-byte hash."""
+    workchain_id_str, address_str = raw_address.split(':')
+    return struct.pack('>b', int(workchain_id_str)) + bytes.fromhex(address_str)
+
+
+def unpack_raw_address(packed: bytes) -> str:
+    """Unpack raw address packed by pack_raw_address."""
+    workchain_id, = struct.unpack('>b', packed[:1])
+    return f"{workchain_id}:{packed[1:].hex()}"
+
+
 def convert_raw_to_user_friendly(raw_address: str) -> dict:
     # Split workchain_id and address
     workchain_id_str, address_str = raw_address.split(':')
@@ -0,0 +1,189 @@
+import asyncio
+import functools
+import logging
+import os
+import signal
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from typing import Optional
+
+
+logger = logging.getLogger('nedoindexer.profiling')
+
+
+class Profiler:
+    """
+    Профилировщик, включаемый в работающем процессе.
+
+    На заданное окно времени собирает сэмплирующий профиль CPU (стеки вызовов
+    по таймеру ITIMER_PROF) и длительности этапов, отмеченных stage/trace,
+    после чего сохраняет отчеты в output_dir. В выключенном состоянии каждый
+    этап стоит одной проверки флага.
+    """
+
+    def __init__(self, output_dir: str='profiles', window: float=60, interval: float=0.005) -> None:
+        self.output_dir = output_dir
+        self.window = window
+        self.interval = interval
+        self.active = False
+        self._samples: Counter[str] = Counter()
+        self._stages: dict[str, list[float]] = {}
+        self._started_at: Optional[datetime] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        self._samples[';'.join(reversed(stack))] += 1
+
+    def record(self, stage: str, duration: float) -> None:
+        """Записать длительность этапа, если профилировщик включен."""
+        if self.active:
+            self._stages.setdefault(stage, []).append(duration)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замерить длительность этапа, если профилировщик включен."""
+        if not self.active:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def start(self, window: Optional[float]=None) -> bool:
+        """
+        Включить профилирование на window секунд.
+
+        Возвращает False, если профилирование уже идет.
+        """
+        if self.active:
+            return False
+        window = window or self.window
+
+        self._samples.clear()
+        self._stages = {}
+        self._started_at = datetime.now()
+        self.active = True
+
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._stop_handle = asyncio.get_running_loop().call_later(window, self.stop)
+
+        logger.info(f"[%] Профилирование включено на {window} сек.")
+        return True
+
+    def stop(self) -> Optional[str]:
+        """Выключить профилирование и сохранить отчеты. Возвращает префикс путей отчетов."""
+        if not self.active:
+            return None
+
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.active = False
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+        try:
+            prefix = self._dump()
+        except OSError as ex:
+            logger.error(f"[-] Не удалось сохранить отчеты профилирования: {ex}")
+            return None
+
+        logger.info(f"[%] Профилирование выключено, отчеты сохранены: {prefix}.*")
+        return prefix
+
+    def _dump(self) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, self._started_at.strftime('profile-%Y%m%d-%H%M%S'))
+
+        # формат свернутых стеков, совместимый с flamegraph.pl и speedscope
+        with open(f"{prefix}.folded", 'w') as file:
+            for stack, count in self._samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+        with open(f"{prefix}.stages.txt", 'w') as file:
+            file.write(f"{'stage':<40} {'count':>8} {'total, s':>10} {'mean, s':>10} {'max, s':>10}\n")
+            stages = sorted(self._stages.items(), key=lambda item: sum(item[1]), reverse=True)
+            for name, durations in stages:
+                total = sum(durations)
+                file.write(
+                    f"{name:<40} {len(durations):>8} {total:>10.3f} "
+                    f"{total / len(durations):>10.4f} {max(durations):>10.4f}\n"
+                )
+
+        return prefix
+
+    async def _handle_control(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Обработать команду управления: start [секунды], stop или status.
+        """
+        command, *args = (await reader.readline()).decode().split() or ['status']
+        if command == 'start':
+            try:
+                started = self.start(float(args[0]) if args else None)
+            except ValueError:
+                answer = f"invalid window {args[0]}"
+            else:
+                answer = 'started' if started else 'already running'
+        elif command == 'stop':
+            prefix = self.stop()
+            answer = f"saved {prefix}" if prefix else 'not running'
+        elif command == 'status':
+            answer = 'running' if self.active else 'idle'
+        else:
+            answer = f"unknown command {command}"
+
+        writer.write(f"{answer}\n".encode())
+        await writer.drain()
+        writer.close()
+
+    async def install(self, port: Optional[int]=None) -> None:
+        """
+        Подключить управление профилировщиком.
+
+        SIGUSR1 включает профилирование на стандартное окно. Если задан port,
+        дополнительно открывается управляющий TCP сокет на 127.0.0.1.
+        """
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.start)
+        if port:
+            self._server = await asyncio.start_server(self._handle_control, '127.0.0.1', port)
+            logger.info(f"[^] Управление профилировщиком доступно на 127.0.0.1:{port}")
+
+    async def uninstall(self) -> None:
+        """Отключить управление профилировщиком и сохранить незавершенные отчеты."""
+        self.stop()
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+profiler = Profiler()
+
+
+def trace(stage: str):
+    """
+    Декоратор для замера длительности корутины как этапа профилирования.
+    """
+    def decorator(coroutine):
+        @functools.wraps(coroutine)
+        async def wrapper(*args, **kwargs):
+            if not profiler.active:
+                return await coroutine(*args, **kwargs)
+            with profiler.stage(stage):
+                return await coroutine(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,4 +1,4 @@
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 from fake_useragent import UserAgent
 
 
@@ -15,14 +15,24 @@ class ProxyHandler:
         self.proxies: list['ProxyHandler.Proxy'] = []
         self.ua = UserAgent()
 
-    def set_proxies(self, file='proxy_keys.txt'):
-        """Устанавливает прокси."""
+    def set_proxies(self, file='proxy_keys.txt', user_agents: Optional[dict[str, str]]=None):
+        """
+        Устанавливает прокси.
+
+        Юзер-агенты из user_agents (например, из снимка состояния) сохраняются
+        за своими прокси, остальным назначается случайный.
+        """
+        user_agents = user_agents or {}
         # прокси и ключи должны быть разделены тройным дооеточием - :::
         with open(file, 'r') as file:
             for line in file:
                 address, key = line.rstrip('\n').split(':::')
-                user_agent = self.ua.random
+                user_agent = user_agents.get(address) or self.ua.random
                 self.proxies.append(self.Proxy(address, key, user_agent))
 
     def get_proxies(self) -> list['ProxyHandler.Proxy']:
-        return self.proxies
\ No newline at end of file
+        return self.proxies
+
+    def get_user_agents(self) -> dict[str, str]:
+        """Получить юзер-агенты, назначенные прокси."""
+        return {proxy.address: proxy.user_agent for proxy in self.proxies}
\ No newline at end of file
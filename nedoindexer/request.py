@@ -4,6 +4,7 @@ import logging
 
 import aiohttp
 
+from nedoindexer.profiling import trace
 from nedoindexer.proxy import ProxyHandler
 
 
@@ -13,7 +14,14 @@ logger = logging.getLogger(f"nedoindexer.requests")
 class IndexerRequests:
     """Класс для сетевых запросов в индексатор."""
 
-    def __init__(self, timeout: float=10, request_per: float=0.2) -> None:
+    DEFAULT_TIMEOUT = 10
+    DEFAULT_REQUEST_PER = 0.2
+    TIMEOUT_STEP = 2
+    REQUEST_PER_STEP = 0.1
+    MAX_TIMEOUT = 30
+    MAX_REQUEST_PER = 1
+
+    def __init__(self, timeout: float=DEFAULT_TIMEOUT, request_per: float=DEFAULT_REQUEST_PER) -> None:
         self.get_wallet_info_url = "https://toncenter.com/api/v3/wallet?address"
         self.get_jetton_wallets_url = "https://toncenter.com/api/v3/jetton/wallets?owner_address"
         self._timeout = timeout
@@ -24,6 +32,18 @@ class IndexerRequests:
         }
         self._processed_wallets_count = 0
 
+    @classmethod
+    def restore(cls, timeout: float, request_per: float) -> 'IndexerRequests':
+        """
+        Создать обработчик с таймаутом и частотой запросов из снимка состояния.
+
+        Значения уменьшаются на один шаг и ограничиваются сверху, чтобы после
+        перезапусков они не росли бесконечно, но не опускаются ниже значений по умолчанию.
+        """
+        timeout = min(max(timeout - cls.TIMEOUT_STEP, cls.DEFAULT_TIMEOUT), cls.MAX_TIMEOUT)
+        request_per = min(max(request_per - cls.REQUEST_PER_STEP, cls.DEFAULT_REQUEST_PER), cls.MAX_REQUEST_PER)
+        return cls(timeout, round(request_per, 3))
+
     @staticmethod
     def timeout_handling(coroutine):
         """
@@ -45,6 +65,7 @@ class IndexerRequests:
 
         return wrapper
 
+    @trace('IndexerRequests.send_request')
     @timeout_handling
     async def send_request(self, url: str, session: aiohttp.ClientSession, address: str, proxy: 'ProxyHandler.Proxy') -> dict|None:
         """
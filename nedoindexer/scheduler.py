@@ -0,0 +1,138 @@
+import heapq
+import logging
+import math
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+
+logger = logging.getLogger('nedoindexer.scheduler')
+
+
+class LookupScheduler:
+    """
+    Ограниченный планировщик очереди запросов к индексатору с приоритетами.
+
+    Приоритет адреса тем выше, чем давнее обновлялась его запись в БД, чем чаще
+    он встречается в транзакциях и если он есть в списке наблюдения. Адресам без
+    записи в БД (новые, неинициализированные, не кошельки) назначается устаревание
+    unknown_staleness. За обработку выдается не больше адресов, чем прокси успевают
+    обслужить, остальные откладываются до следующей обработки, а их приоритеты
+    пересчитываются при каждой выдаче. Если отложенных адресов больше max_backlog,
+    наименее важные отбрасываются (адреса из списка наблюдения не отбрасываются никогда).
+    """
+
+    WATCH_WEIGHT = 10
+    ACTIVITY_WEIGHT = 0.5
+
+    def __init__(
+            self,
+            max_backlog: int=5000,
+            batch_seconds: float=10,
+            staleness_cap: float=3600,
+            activity_decay: float=0.9,
+            unknown_staleness: float=0.5
+        ) -> None:
+        self.max_backlog = max_backlog
+        self.batch_seconds = batch_seconds
+        self.staleness_cap = staleness_cap
+        self.activity_decay = activity_decay
+        self.unknown_staleness = unknown_staleness
+        self.watch_list: set[str] = set()
+        self.shed_count = 0
+        self.last_shed_count = 0
+        self._activity: Counter[str] = Counter()
+        self._pending: dict[str, Optional[datetime]] = {}
+        self._priorities: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set_watch_list(self, file='watch_list.txt'):
+        """Загрузить список наблюдения: по одному raw-адресу в строке."""
+        try:
+            with open(file, 'r') as file:
+                self.watch_list = {line.strip().lower() for line in file if line.strip()}
+        except FileNotFoundError:
+            return
+        logger.info(f"[+] В списке наблюдения {len(self.watch_list)} адресов.")
+
+    def observe(self, addresses: list[str]) -> None:
+        """Учесть активность адресов в очередной обработке."""
+        self._activity = Counter({
+            address: count * self.activity_decay for address, count in self._activity.items()
+            if count * self.activity_decay >= 0.1
+        })
+        self._activity.update(addresses)
+
+    def _get_priority(self, address: str, last_update: Optional[datetime], now: datetime) -> float:
+        if last_update is None:
+            staleness = self.unknown_staleness
+        else:
+            staleness = min((now - last_update).total_seconds() / self.staleness_cap, 1)
+
+        score = staleness + self.ACTIVITY_WEIGHT * math.log1p(self._activity[address])
+        if address in self.watch_list:
+            score += self.WATCH_WEIGHT
+        return -score
+
+    def push(self, addresses: list[str], last_updates: dict[str, datetime]) -> None:
+        """
+        Добавить адреса в очередь.
+
+        last_updates - время последнего обновления записей адресов в БД.
+        """
+        for address in addresses:
+            self._pending[address] = last_updates.get(address)
+
+    def get_capacity(self, proxies_count: int, request_per: float) -> int:
+        """
+        Количество адресов, которое прокси успевают обработать за batch_seconds.
+
+        На каждый адрес приходится два запроса: информация о кошельке и его жетоны.
+        """
+        return max(1, int(proxies_count * self.batch_seconds / request_per / 2))
+
+    def take(self, capacity: int) -> list[str]:
+        """
+        Выдать до capacity самых важных адресов в порядке убывания приоритета.
+
+        Остальные адреса откладываются, при превышении max_backlog наименее важные
+        отбрасываются.
+        """
+        self.last_shed_count = 0
+        now = datetime.now()
+        priorities = {
+            address: self._get_priority(address, last_update, now)
+            for address, last_update in self._pending.items()
+        }
+
+        taken = heapq.nsmallest(capacity, priorities.items(), key=lambda item: item[1])
+        for address, _ in taken:
+            del self._pending[address]
+            del priorities[address]
+        self._priorities = dict(taken)
+
+        if self._pending:
+            logger.info(f"[~] Отложено {len(self._pending)} адресов.")
+
+        if len(self._pending) > self.max_backlog:
+            self._shed(priorities)
+
+        return [address for address, _ in taken]
+
+    def _shed(self, priorities: dict[str, float]) -> None:
+        """Отбросить наименее важные отложенные адреса сверх max_backlog."""
+        sheddable = [item for item in priorities.items() if item[0] not in self.watch_list]
+        shed = heapq.nlargest(len(self._pending) - self.max_backlog, sheddable, key=lambda item: item[1])
+        for address, _ in shed:
+            del self._pending[address]
+
+        self.shed_count += len(shed)
+        self.last_shed_count = len(shed)
+        logger.warning(f"[!] Очередь запросов переполнена: отброшено {len(shed)} адресов, всего отброшено {self.shed_count}.")
+        logger.debug(f"[!] Отброшенные адреса: {', '.join(address for address, _ in shed)}")
+
+    def get_priority(self, address: str) -> float:
+        """Приоритет адреса, выданного последним вызовом take."""
+        return self._priorities.get(address, 0)
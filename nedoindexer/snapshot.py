@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+from time import time
+from typing import NamedTuple, Optional
+
+from nedoindexer.encrypt import pack_raw_address, unpack_raw_address
+
+
+logger = logging.getLogger('nedoindexer.snapshot')
+
+
+PACKED_ADDRESS_LENGTH = 33
+
+
+class Snapshot(NamedTuple):
+    """Представление снимка состояния индексатора."""
+    created_at: float
+    blockchain_config: Optional[dict]
+    config_saved_at: float
+    liteservers: Optional[list[int]]
+    timeout: float
+    request_per: float
+    user_agents: dict[str, str]
+    jettons: Optional[set[str]]
+    freshness: dict[str, float]
+
+
+class SnapshotHandler:
+    """
+    Класс для сохранения и загрузки снимка состояния.
+
+    Снимок позволяет после перезапуска сразу подключаться только к работающим
+    лайт-серверам (полная конфигурация сети хранится в снимке и загружается заново
+    раз в max_age), восстановить настройки частоты запросов и таймаута, юзер-агенты
+    прокси, известные жетоны и кэш свежести, не загружая заново таблицу жетонов
+    и не подключаясь ко всем лайт-серверам.
+    """
+
+    def __init__(self, filename: str='snapshot.json', max_age: float=3600, min_alive_share: float=0.5) -> None:
+        self.filename = filename
+        self.max_age = max_age
+        self.min_alive_share = min_alive_share
+
+    @staticmethod
+    def _pack_addresses(addresses: set[str]) -> str:
+        return base64.b64encode(b''.join(pack_raw_address(address) for address in sorted(addresses))).decode()
+
+    @staticmethod
+    def _unpack_addresses(packed: str) -> set[str]:
+        data = base64.b64decode(packed)
+        return {
+            unpack_raw_address(data[i:i + PACKED_ADDRESS_LENGTH])
+            for i in range(0, len(data), PACKED_ADDRESS_LENGTH)
+        }
+
+    def _write(self, data: dict) -> None:
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(tmp_filename, self.filename)
+
+    def _read(self) -> dict:
+        with open(self.filename, 'r') as file:
+            return json.load(file)
+
+    async def save(
+            self,
+            blockchain_config: dict,
+            config_saved_at: float,
+            liteservers: list[int],
+            timeout: float,
+            request_per: float,
+            user_agents: dict[str, str],
+            jettons: set[str],
+            freshness: dict[str, float]
+        ) -> None:
+        """Сохранить снимок состояния."""
+        data = {
+            'created_at': time(),
+            'blockchain_config': blockchain_config,
+            'config_saved_at': config_saved_at,
+            'liteservers': liteservers,
+            'timeout': timeout,
+            'request_per': request_per,
+            'user_agents': user_agents,
+            'jettons': self._pack_addresses(jettons),
+            'freshness': freshness,
+        }
+        await asyncio.to_thread(self._write, data)
+        logger.info(
+            f"[+] Снимок состояния сохранен: {len(liteservers)} из {len(blockchain_config['liteservers'])} лайт-серверов, "
+            f"{len(jettons)} жетонов, {len(freshness)} адресов в кэше свежести."
+        )
+
+    def load(self) -> Optional[Snapshot]:
+        """
+        Загрузить снимок состояния.
+
+        Если снимка нет или он поврежден, возвращает None. Если конфигурация сети
+        старше max_age, она не используется. Если снимок старше max_age, не используются
+        жетоны. Если работающих лайт-серверов меньше min_alive_share от всех, клиент
+        подключается ко всем серверам сохраненной конфигурации.
+        """
+        try:
+            data = self._read()
+            snapshot = Snapshot(
+                data['created_at'],
+                data['blockchain_config'],
+                data['config_saved_at'],
+                data['liteservers'],
+                data['timeout'],
+                data['request_per'],
+                data['user_agents'],
+                self._unpack_addresses(data['jettons']),
+                data['freshness']
+            )
+
+            now = time()
+            if now - snapshot.created_at > self.max_age:
+                snapshot = snapshot._replace(jettons=None)
+            if now - snapshot.config_saved_at > self.max_age:
+                snapshot = snapshot._replace(blockchain_config=None, liteservers=None)
+            elif len(snapshot.liteservers) < len(snapshot.blockchain_config['liteservers']) * self.min_alive_share:
+                snapshot = snapshot._replace(liteservers=None)
+        except FileNotFoundError:
+            logger.info("[^] Снимок состояния не найден, холодный запуск.")
+            return None
+        except (ValueError, KeyError, TypeError) as ex:
+            logger.error(f"[-] Снимок состояния поврежден: {ex}")
+            return None
+
+        logger.info(f"[^] Загружен снимок состояния от {snapshot.created_at}.")
+        return snapshot